@@ -1,76 +1,114 @@
 #!/usr/bin/env python3
-import pandas as pd
+import polars as pl
 from pathlib import Path
 
 BRONZE = Path("data/bronze")
 SILVER = Path("data/silver")
 SILVER.mkdir(parents=True, exist_ok=True)
 
-def parse_dt(col):
+# same layout as bronze: zstd and large row groups for full-column readers
+PARQUET_OPTS = dict(compression="zstd", compression_level=3, row_group_size=131_072)
+
+# columns the feature builders use; projection pushdown leaves the rest of bronze unread
+NEEDED = [
+    "activity_id", "activity_type", "start_time_gmt", "start_time_local",
+    "distance_m", "duration_s", "avg_speed_mps", "min_temp_c", "max_temp_c",
+]
+
+# datetime.isoformat() as in older bronze files, plus date-only; %.f also accepts whole seconds
+ISO_FORMATS = ("%Y-%m-%dT%H:%M:%S%.f%z", "%Y-%m-%dT%H:%M:%S%.f", "%Y-%m-%d")
+
+def parse_dt(name, dtype):
     """
-    Robust ISO8601 parser:
-    - handles strings with/without fractional seconds, with/without timezone
+    Timestamp column -> Datetime(UTC) expression:
+    - epoch milliseconds (current bronze) via from_epoch
+    - ISO8601 strings with/without fractional seconds, with/without timezone,
+      "Z" or a space separator, or a bare date
     - leaves already-datetime values alone
-    - coerces bad rows to NaT (won't crash)
+    - coerces bad rows to null (won't crash)
     """
-    if pd.api.types.is_datetime64_any_dtype(col):
-        return col.dt.tz_convert("UTC") if col.dt.tz is not None else col.dt.tz_localize("UTC")
-    # pandas >=2.0 supports format="ISO8601"; fall back to "mixed" if needed
-    try:
-        return pd.to_datetime(col, format="ISO8601", utc=True, errors="coerce")
-    except TypeError:
-        # older pandas: use mixed inference
-        return pd.to_datetime(col, utc=True, errors="coerce")
+    col = pl.col(name)
+    if isinstance(dtype, pl.Datetime):
+        out = col.dt.convert_time_zone("UTC") if dtype.time_zone else col.dt.replace_time_zone("UTC")
+    elif dtype.is_numeric():
+        out = pl.from_epoch(col.cast(pl.Int64), time_unit="ms").dt.replace_time_zone("UTC")
+    else:
+        # fold the other ISO8601 spellings onto the isoformat() layouts
+        iso = col.str.strip_chars().str.replace(r"[Zz]$", "+00:00").str.replace(" ", "T", literal=True)
+        aware, *naive = (iso.str.to_datetime(fmt, strict=False) for fmt in ISO_FORMATS)
+        out = pl.coalesce(aware, *(n.dt.replace_time_zone("UTC") for n in naive))
+    return out.cast(pl.Datetime("us", "UTC"))
 
 def pace_s_per_km(avg_speed_mps):
-    return 1000.0 / max(avg_speed_mps, 1e-6)
+    return 1000.0 / avg_speed_mps.clip(lower_bound=1e-6)
 
 def load():
-    acts = pd.read_parquet(BRONZE/"activities.parquet")
-    acts["start_time_gmt"]  = parse_dt(acts["start_time_gmt"])
-    acts["start_time_local"] = parse_dt(acts.get("start_time_local", acts["start_time_gmt"]))
+    acts = pl.scan_parquet(BRONZE/"activities.parquet")
+    schema = acts.collect_schema()
+    # bronze keeps epoch ms; older exports carry ISO strings instead
+    gmt = "start_time_gmt_ms" if "start_time_gmt_ms" in schema else "start_time_gmt"
+    local = next((c for c in ("start_time_local_ms", "start_time_local") if c in schema), gmt)
+    acts = acts.with_columns(
+        parse_dt(gmt, schema[gmt]).alias("start_time_gmt"),
+        parse_dt(local, schema[local]).alias("start_time_local"),
+    ).select(NEEDED)
     if (BRONZE/"splits.parquet").exists():
-        splits = pd.read_parquet(BRONZE/"splits.parquet")
+        splits = pl.scan_parquet(BRONZE/"splits.parquet")
     else:
-        splits = pd.DataFrame()
+        splits = pl.LazyFrame()
     return acts, splits
 
 def per_activity_features(acts):
-    df = acts.copy()
-    df["distance_km"] = df["distance_m"] / 1000
-    df["duration_min"] = df["duration_s"] / 60
-    df["avg_pace_s_per_km"] = df["avg_speed_mps"].apply(pace_s_per_km)
-    df["elev_gain_m"] = 0.0  # if you mapped elevation cm -> m earlier, fill it here
-    # temp buckets
-    df["temp_c"] = df[["min_temp_c","max_temp_c"]].mean(axis=1, skipna=True)
-    # type flags
-    df["is_treadmill"] = (df["activity_type"]=="treadmill_running").astype(int)
-    return df
+    return acts.with_columns(
+        (pl.col("distance_m") / 1000).alias("distance_km"),
+        (pl.col("duration_s") / 60).alias("duration_min"),
+        pace_s_per_km(pl.col("avg_speed_mps")).alias("avg_pace_s_per_km"),
+        pl.lit(0.0).alias("elev_gain_m"),  # if you mapped elevation cm -> m earlier, fill it here
+        # temp buckets
+        pl.mean_horizontal("min_temp_c", "max_temp_c").alias("temp_c"),
+        # type flags
+        pl.col("activity_type").eq("treadmill_running").fill_null(False).cast(pl.Int64).alias("is_treadmill"),
+    )
 
 def weekly_rollups(df):
-    w = df.set_index("start_time_gmt").sort_index()
-    g = w.resample("W")
-    agg = pd.DataFrame({
-        "weekly_km": g["distance_km"].sum(),
-        "weekly_runs": g["activity_id"].count(),
-        "weekly_duration_min": g["duration_min"].sum(),
-        "avg_pace_s_per_km": (1000.0 / (g["distance_m"].sum()/w.resample("W")["duration_s"].sum())).fillna(pd.NA),
-    }).reset_index().rename(columns={"start_time_gmt":"week"})
-    # ACWR: 7d / 28d (very rough)
-    w7 = w["distance_km"].rolling("7D").sum()
-    w28 = w["distance_km"].rolling("28D").sum()
-    w = w.assign(acwr = (w7 / (w28/4)).fillna(0))
-    acwr = w.resample("W")["acwr"].mean().reset_index(drop=True)
-    agg["acwr"] = acwr
-    return agg
+    # ACWR: 7d / 28d (very rough); missing distances count as 0 in the windows.
+    # rolling_sum_by over the sorted timestamps is a sliding-window sum (no per-row window search)
+    km = pl.col("distance_km").fill_null(0)
+    # a time window ends at the current row, as in pandas: runs strictly before this start time,
+    # plus the runs sharing it up to this one (ties broken by activity_id). Only additions, so an
+    # all-zero window stays exactly 0 for the guard below.
+    ties_so_far = km.cum_sum().over("start_time_gmt")
+    w7 = km.rolling_sum_by("start_time_gmt", "7d", closed="none").fill_null(0) + ties_so_far
+    w28 = km.rolling_sum_by("start_time_gmt", "28d", closed="none").fill_null(0) + ties_so_far
+    # w7 / (w28/4) with the constant folded; empty 28d windows read as 0 without a NaN pass
+    acwr = pl.when(w28 > 0).then(4.0 * w7 / w28).otherwise(0.0)
+    w = df.sort("start_time_gmt", "activity_id").with_columns(acwr.alias("acwr"))
+    # Monday..Sunday weeks labelled by their Sunday, like pandas resample("W")
+    weekly = w.group_by_dynamic("start_time_gmt", every="1w").agg(
+        pl.col("distance_km").sum().alias("weekly_km"),
+        pl.col("activity_id").count().cast(pl.Int64).alias("weekly_runs"),
+        pl.col("duration_min").sum().alias("weekly_duration_min"),
+        pl.when(pl.col("distance_m").sum() > 0)
+          .then(1000.0 * pl.col("duration_s").sum() / pl.col("distance_m").sum())
+          .alias("avg_pace_s_per_km"),
+        pl.col("acwr").mean().alias("acwr"),
+    ).select(pl.col("start_time_gmt").dt.offset_by("6d").alias("week"), pl.exclude("start_time_gmt"))
+    # keep weeks without runs as explicit zero rows
+    weeks = weekly.select(pl.datetime_range(pl.col("week").min(), pl.col("week").max(), "1w").alias("week"))
+    return weeks.join(weekly, on="week", how="left").with_columns(
+        pl.col("weekly_km", "weekly_runs", "weekly_duration_min").fill_null(0),
+    )
 
 def main():
     acts, _splits = load()
     fa = per_activity_features(acts)
     fw = weekly_rollups(fa)
 
-    fa.to_parquet(SILVER/"features_activities.parquet", index=False)
-    fw.to_parquet(SILVER/"features_weekly.parquet", index=False)
+    # one query plan: the bronze scan and feature columns are shared by both sinks
+    pl.collect_all([
+        fa.sink_parquet(SILVER/"features_activities.parquet", lazy=True, **PARQUET_OPTS),
+        fw.sink_parquet(SILVER/"features_weekly.parquet", lazy=True, **PARQUET_OPTS),
+    ])
 
     print("wrote:", SILVER/"features_activities.parquet")
     print("wrote:", SILVER/"features_weekly.parquet")
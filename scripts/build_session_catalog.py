@@ -5,6 +5,8 @@ import pandas as pd
 
 SILVER = Path("data/silver")
 CAT_PATH = SILVER/"sessions.json"
+# only what planned_pace_from_recent reads; keeps its sort from copying every feature column
+ANCHOR_COLS = ["start_time_gmt", "distance_km", "avg_pace_s_per_km"]
 
 def planned_pace_from_recent(df):
     # set a “training pace” anchor from last 2–4 weeks 10k-ish runs
@@ -40,7 +42,7 @@ def make_sessions(anchor_pace):
     return sessions
 
 def main():
-    fa = pd.read_parquet(SILVER/"features_activities.parquet")
+    fa = pd.read_parquet(SILVER/"features_activities.parquet", columns=ANCHOR_COLS)
     anchor = planned_pace_from_recent(fa)
     sessions = make_sessions(anchor)
     SILVER.mkdir(parents=True, exist_ok=True)
@@ -13,13 +13,17 @@ Outputs:
 """
 
 from __future__ import annotations
-import json
+import itertools
+import os
 import sys
+import tempfile
 import typing as T
 from pathlib import Path
-from datetime import datetime, timezone
 
-import pandas as pd
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import typer
 
 app = typer.Typer(help="Ingest Garmin activities into Parquet (running-only).")
@@ -28,13 +32,27 @@ app = typer.Typer(help="Ingest Garmin activities into Parquet (running-only).")
 
 RUN_TYPES = {"running", "treadmill_running"}
 
+BATCH = 10_000  # raw activities normalized at a time
+ROW_GROUP_SIZE = 131_072  # rows per Parquet row group; fewer, larger batches for full-column readers
+PARQUET_OPTS = dict(compression="zstd", compression_level=3, use_dictionary=True)
+SPLIT_SEQ = "__activity_seq"  # spill-only column: input position of a split's activity
+
 CM_PER_M = 100.0
 CM_PER_MS_TO_MPS = 10.0  # 1 cm/ms == 10 m/s
 
-def ms_to_iso(ms: T.Optional[float]) -> T.Optional[str]:
-    if ms is None:
+def ms_to_int(ms: T.Optional[float]) -> T.Optional[int]:
+    # timestamps stay epoch ms; build_features converts the whole column at once
+    return None if ms is None else int(ms)
+
+def to_int(v: T.Any, bits: int) -> T.Optional[int]:
+    # Garmin sends these as JSON floats (166.0); round instead of letting Arrow truncate,
+    # and null out anything non-numeric or outside the column's intN range
+    try:
+        i = int(round(float(v)))
+    except (TypeError, ValueError, OverflowError):
         return None
-    return datetime.fromtimestamp(float(ms) / 1000.0, tz=timezone.utc).isoformat()
+    lim = 1 << (bits - 1)
+    return i if -lim <= i < lim else None
 
 def ms_to_s(ms: T.Optional[float]) -> T.Optional[float]:
     return None if ms is None else float(ms) / 1000.0
@@ -57,6 +75,48 @@ UNIT_MAP = {
     "DIMENSIONLESS": ("value", 1.0),
 }
 
+# Pinned so every streamed batch lands in the same Parquet schema. Narrow types
+# for integer-valued Garmin fields (HR, power, RPE/feel) keep them ints with
+# native nulls instead of float64, and sensor averages fit in float32.
+ACTIVITY_SCHEMA = pa.schema([
+    ("activity_id", pa.int64()),
+    ("activity_type", pa.string()),
+    ("sport", pa.string()),
+    ("start_time_gmt_ms", pa.int64()),
+    ("start_time_local_ms", pa.int64()),
+    ("duration_s", pa.float64()),
+    ("elapsed_s", pa.float64()),
+    ("moving_s", pa.float64()),
+    ("distance_m", pa.float64()),
+    ("avg_speed_mps", pa.float64()),
+    ("max_speed_mps", pa.float64()),
+    ("avg_hr", pa.int16()),
+    ("max_hr", pa.int16()),
+    ("min_hr", pa.int16()),
+    ("avg_power_w", pa.int32()),
+    ("max_power_w", pa.int32()),
+    ("np_w", pa.int32()),
+    ("avg_double_cad_spm", pa.float32()),
+    ("avg_run_cad_single", pa.float32()),
+    ("avg_stride_cm", pa.float32()),
+    ("avg_gct_ms", pa.float32()),
+    ("avg_vo_cm", pa.float32()),
+    ("avg_vertical_ratio", pa.float32()),
+    ("min_temp_c", pa.float32()),
+    ("avg_temp_c", pa.float32()),
+    ("max_temp_c", pa.float32()),
+    ("rpe", pa.int8()),
+    ("feel", pa.int8()),
+    ("device_id", pa.int64()),
+    ("manufacturer", pa.string()),
+    ("lap_count", pa.int32()),
+    ("start_lat", pa.float64()),
+    ("start_lon", pa.float64()),
+    ("end_lat", pa.float64()),
+    ("end_lon", pa.float64()),
+    ("location_name", pa.string()),
+])
+
 # -------------------- Normalizers --------------------
 
 def is_running_activity(activity: dict) -> bool:
@@ -74,20 +134,20 @@ def norm_activity(a: dict) -> dict:
         "activity_id": a.get("activityId"),
         "activity_type": (a.get("activityType") or "").lower(),
         "sport": a.get("sportType"),
-        "start_time_gmt": ms_to_iso(a.get("startTimeGmt")),
-        "start_time_local": ms_to_iso(a.get("startTimeLocal")),
+        "start_time_gmt_ms": ms_to_int(a.get("startTimeGmt")),
+        "start_time_local_ms": ms_to_int(a.get("startTimeLocal")),
         "duration_s": ms_to_s(a.get("duration")),
         "elapsed_s": ms_to_s(a.get("elapsedDuration", a.get("duration"))),
         "moving_s": ms_to_s(a.get("movingDuration", a.get("duration"))),
         "distance_m": cm_to_m(a.get("distance")),
         "avg_speed_mps": cm_per_ms_to_mps(a.get("avgSpeed")),
         "max_speed_mps": cm_per_ms_to_mps(a.get("maxSpeed")),
-        "avg_hr": a.get("avgHr"),
-        "max_hr": a.get("maxHr"),
-        "min_hr": a.get("minHr"),
-        "avg_power_w": a.get("avgPower"),
-        "max_power_w": a.get("maxPower"),
-        "np_w": a.get("normPower"),
+        "avg_hr": to_int(a.get("avgHr"), 16),
+        "max_hr": to_int(a.get("maxHr"), 16),
+        "min_hr": to_int(a.get("minHr"), 16),
+        "avg_power_w": to_int(a.get("avgPower"), 32),
+        "max_power_w": to_int(a.get("maxPower"), 32),
+        "np_w": to_int(a.get("normPower"), 32),
         "avg_double_cad_spm": a.get("avgDoubleCadence"),
         "avg_run_cad_single": a.get("avgRunCadence"),
         "avg_stride_cm": a.get("avgStrideLength"),
@@ -97,11 +157,11 @@ def norm_activity(a: dict) -> dict:
         "min_temp_c": min_t,
         "avg_temp_c": avg_t,
         "max_temp_c": max_t,
-        "rpe": a.get("workoutRpe"),
-        "feel": a.get("workoutFeel"),
+        "rpe": to_int(a.get("workoutRpe"), 8),
+        "feel": to_int(a.get("workoutFeel"), 8),
         "device_id": a.get("deviceId"),
         "manufacturer": a.get("manufacturer"),
-        "lap_count": a.get("lapCount"),
+        "lap_count": to_int(a.get("lapCount"), 32),
         # Optional geo (may not exist in treadmill)
         "start_lat": a.get("startLatitude"),
         "start_lon": a.get("startLongitude"),
@@ -110,13 +170,30 @@ def norm_activity(a: dict) -> dict:
         "location_name": a.get("locationName"),
     }
 
+def _nulls_last(v: T.Any) -> tuple:
+    return (v is None, v or 0)
+
+def split_order(split: dict) -> tuple:
+    return _nulls_last(split.get("messageIndex"))
+
+def activity_columns(acts: T.Iterable[dict]) -> dict[str, list]:
+    """Normalize activities into column lists in one pass (avoids list-of-dicts inference)."""
+    cols: dict[str, list] = {}
+    for a in acts:
+        row = norm_activity(a)
+        if not cols:
+            cols = {k: [] for k in row}
+        for k, v in row.items():
+            cols[k].append(v)
+    return cols
+
 def flatten_split(activity_id: T.Any, split: dict) -> dict:
     base = {
         "activity_id": activity_id,
         "index": split.get("messageIndex"),
         "type": split.get("type"),
-        "start_gmt": ms_to_iso(split.get("startTimeGMT")),
-        "end_gmt": ms_to_iso(split.get("endTimeGMT")),
+        "start_gmt_ms": ms_to_int(split.get("startTimeGMT")),
+        "end_gmt_ms": ms_to_int(split.get("endTimeGMT")),
         "duration_s": ms_to_s((split.get("endTimeGMT") or 0) - (split.get("startTimeGMT") or 0)),
         "start_source": split.get("startTimeSource"),
         "end_source": split.get("endTimeSource"),
@@ -125,51 +202,84 @@ def flatten_split(activity_id: T.Any, split: dict) -> dict:
         "end_lat": split.get("endLatitude"),
         "end_lon": split.get("endLongitude"),
     }
-    metrics: dict[str, T.Any] = {}
-    for m in split.get("measurements", []):
-        unit = (m.get("unitEnum") or "").upper()
-        field = (m.get("fieldEnum") or "").upper()
-        val = m.get("value")
-        if val is None:
-            continue
-        if unit in UNIT_MAP:
-            suffix, factor = UNIT_MAP[unit]
-            key = f"{field.lower()}__{suffix}"  # e.g., weighted_mean_speed__speed_mps
-            try:
-                metrics[key] = float(val) * factor
-            except Exception:
-                metrics[key] = val
-        else:
-            metrics[f"{field.lower()}__raw"] = val
-    base.update(metrics)
     return base
 
+def metric_key(field: T.Optional[str], unit: T.Optional[str]) -> tuple[str, T.Optional[float]]:
+    """Column name and unit factor for one (fieldEnum, unitEnum) pair; unknown units keep the raw value."""
+    field = (field or "").lower()
+    unit = (unit or "").upper()
+    if unit in UNIT_MAP:
+        suffix, factor = UNIT_MAP[unit]
+        return f"{field}__{suffix}", factor  # e.g., weighted_mean_speed__speed_mps
+    return f"{field}__raw", None
+
+def splits_table(acts: list[dict]) -> pa.Table:
+    """Flatten the splits of a batch of activities straight into Arrow columns (no per-row dicts or pandas)."""
+    base: dict[str, list] = {}
+    metrics: dict[str, list] = {}
+    keys: dict[tuple, tuple[str, T.Optional[float]]] = {}  # (fieldEnum, unitEnum) -> metric_key, looked up once
+    r = 0
+    for a in acts:
+        aid = a.get("activityId")
+        for split in sorted(a.get("splits", []) or [], key=split_order):
+            row = flatten_split(aid, split)
+            if not base:
+                base = {k: [] for k in row}
+            for k, v in row.items():
+                base[k].append(v)
+            for m in split.get("measurements", []):
+                val = m.get("value")
+                if val is None:
+                    continue
+                pair = (m.get("fieldEnum"), m.get("unitEnum"))
+                spec = keys.get(pair)
+                if spec is None:
+                    spec = keys[pair] = metric_key(*pair)
+                key, factor = spec
+                if factor is not None:
+                    try:
+                        val = float(val) * factor
+                    except Exception:
+                        pass
+                col = metrics.get(key)
+                if col is None:
+                    col = metrics[key] = []
+                # pad splits without this metric; a repeated field in one split keeps the last value
+                if len(col) > r:
+                    col[r] = val
+                    continue
+                if len(col) < r:
+                    col.extend([None] * (r - len(col)))
+                col.append(val)
+            r += 1
+
+    for col in metrics.values():
+        col.extend([None] * (r - len(col)))
+    return pa.Table.from_pydict({**base, **metrics})
+
 # -------------------- Loaders --------------------
 
-def load_jsonl(path: Path) -> list[dict]:
-    """Load one activity per line (JSONL)."""
-    acts: list[dict] = []
+def load_jsonl(path: Path) -> T.Iterator[dict]:
+    """Yield one activity per line (JSONL)."""
     with path.open("r", encoding="utf-8", errors="ignore") as f:
         for i, line in enumerate(f, 1):
             line = line.strip()
             if not line:
                 continue
             try:
-                o = json.loads(line)
+                o = orjson.loads(line)
             except Exception as e:
                 print(f"[WARN] JSONL parse error at line {i} in {path.name}: {e}", file=sys.stderr)
                 continue
             # Some wrappers put the object under "activity"
-            a = o.get("activity", o)
-            acts.append(a)
-    return acts
+            yield o.get("activity", o)
 
 def load_json_or_array(path: Path) -> list[dict]:
     """Load a single JSON file that is an object or array; unwrap common wrappers."""
     text = path.read_text(encoding="utf-8", errors="ignore").lstrip("\ufeff").strip()
     if not text:
         return []
-    obj = json.loads(text)
+    obj = orjson.loads(text)
     out: list[dict] = []
 
     def walk(x):
@@ -191,24 +301,77 @@ def load_json_or_array(path: Path) -> list[dict]:
     walk(obj)
     return out
 
-def gather_activities(input_path: Path) -> list[dict]:
-    """Load activities from a file or directory. JSONL preferred."""
+def load_file(path: Path) -> T.Iterator[dict]:
+    """Stream one file, JSONL or JSON by suffix; read errors are reported, not raised."""
+    try:
+        if path.suffix.lower() == ".jsonl":
+            yield from load_jsonl(path)
+        else:
+            yield from load_json_or_array(path)
+    except Exception as e:
+        print(f"[WARN] Failed to read {path}: {e}", file=sys.stderr)
+
+def gather_activities(input_path: Path) -> T.Iterator[dict]:
+    """Stream activities from a file or directory. JSONL preferred."""
     files: list[Path] = []
     if input_path.is_dir():
         files = sorted([p for p in input_path.rglob("*") if p.suffix.lower() in {".json", ".jsonl"}])
     else:
         files = [input_path]
 
-    activities: list[dict] = []
     for f in files:
-        try:
-            if f.suffix.lower() == ".jsonl":
-                activities.extend(load_jsonl(f))
-            else:
-                activities.extend(load_json_or_array(f))
-        except Exception as e:
-            print(f"[WARN] Failed to read {f}: {e}", file=sys.stderr)
-    return activities
+        yield from load_file(f)
+
+def batched(it: T.Iterable[dict], n: int) -> T.Iterator[list[dict]]:
+    it = iter(it)
+    while batch := list(itertools.islice(it, n)):
+        yield batch
+
+# -------------------- Writers --------------------
+
+def spill(path: Path, tbl: pa.Table) -> Path:
+    """Park a normalized batch on disk as Arrow IPC so only one raw batch is held at a time."""
+    with pa.ipc.new_file(path, tbl.schema) as w:
+        w.write_table(tbl)
+    return path
+
+def read_spill(path: Path) -> pa.Table:
+    # memory-mapped: columns are paged in by the writer, not copied up front
+    return pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+
+def conform(tbl: pa.Table, schema: pa.Schema) -> pa.Table:
+    """Cast a batch to the unified schema, adding all-null columns for metrics it never saw."""
+    names = set(tbl.column_names)
+    return pa.Table.from_arrays(
+        [tbl[f.name].cast(f.type) if f.name in names else pa.nulls(tbl.num_rows, f.type) for f in schema],
+        schema=schema,
+    )
+
+def sorted_row_groups(tbl: pa.Table, order: pa.Array) -> T.Iterator[pa.Table]:
+    """Gather a memory-mapped table in sort order, materializing one row group at a time."""
+    for i in range(0, len(order), ROW_GROUP_SIZE):
+        yield tbl.take(order.slice(i, ROW_GROUP_SIZE))
+
+def write_row_groups(path: Path, schema: pa.Schema, tables: T.Iterable[pa.Table]) -> int:
+    """Write a stream of tables as whole ROW_GROUP_SIZE row groups (remainder last); returns rows written."""
+    pending: list[pa.Table] = []
+    n_pending = 0
+    rows = 0
+    with pq.ParquetWriter(path, schema, **PARQUET_OPTS) as writer:
+        for tbl in tables:
+            pending.append(tbl)
+            n_pending += tbl.num_rows
+            rows += tbl.num_rows
+            if n_pending < ROW_GROUP_SIZE:
+                continue
+            tbl = pa.concat_tables(pending)
+            n = tbl.num_rows - tbl.num_rows % ROW_GROUP_SIZE
+            writer.write_table(tbl.slice(0, n), row_group_size=ROW_GROUP_SIZE)
+            pending = [tbl.slice(n)]
+            n_pending = tbl.num_rows - n
+        if n_pending:
+            writer.write_table(pa.concat_tables(pending), row_group_size=ROW_GROUP_SIZE)
+    return rows
 
 # -------------------- Main --------------------
 
@@ -219,41 +382,72 @@ def run(
 ):
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    raw_acts = gather_activities(input_path)
-    if not raw_acts:
-        typer.secho("No activities found in input.", fg=typer.colors.RED, err=True)
-        raise typer.Exit(1)
-
-    # Filter to running-only
-    acts_run = [a for a in raw_acts if is_running_activity(a)]
-    if not acts_run:
-        typer.secho("No running/treadmill_running activities found.", fg=typer.colors.YELLOW)
-        raise typer.Exit(1)
-
-    # Normalize activities
-    df_act = pd.DataFrame([norm_activity(a) for a in acts_run])
-
-    # Normalize splits
-    split_rows: list[dict] = []
-    for a in acts_run:
-        aid = a.get("activityId")
-        for s in a.get("splits", []) or []:
-            split_rows.append(flatten_split(aid, s))
-    df_splits = pd.DataFrame(split_rows) if split_rows else pd.DataFrame(columns=["activity_id"])
-
-    # Sort & write
-    if not df_act.empty:
-        if "start_time_gmt" in df_act.columns:
-            df_act = df_act.sort_values(["start_time_gmt", "activity_id"], kind="mergesort").reset_index(drop=True)
-        df_act.to_parquet(out_dir / "activities.parquet", index=False)
-        typer.secho(f"Wrote {len(df_act):,} rows -> {out_dir/'activities.parquet'}", fg=typer.colors.GREEN)
-
-    if not df_splits.empty:
-        sort_cols = [c for c in ["activity_id", "index"] if c in df_splits.columns]
-        if sort_cols:
-            df_splits = df_splits.sort_values(sort_cols, kind="mergesort").reset_index(drop=True)
-        df_splits.to_parquet(out_dir / "splits.parquet", index=False)
-        typer.secho(f"Wrote {len(df_splits):,} rows -> {out_dir/'splits.parquet'}", fg=typer.colors.GREEN)
+    seen = 0
+    def keep(a: dict) -> bool:
+        nonlocal seen
+        seen += 1
+        return is_running_activity(a)
+
+    act_path = out_dir / "activities.parquet"
+    split_path = out_dir / "splits.parquet"
+    # Spills and new outputs live next to bronze; the old files are replaced only once both are written
+    with tempfile.TemporaryDirectory(dir=out_dir, prefix=".ingest-") as tmp:
+        tmp_dir = Path(tmp)
+        act_parts: list[Path] = []
+        split_parts: list[Path] = []
+        split_schemas: list[pa.Schema] = []
+        n_batched = 0
+        for i, batch in enumerate(batched(filter(keep, gather_activities(input_path)), BATCH)):
+            # Normalize activities
+            tbl = pa.Table.from_pydict(activity_columns(batch), schema=ACTIVITY_SCHEMA)
+            act_parts.append(spill(tmp_dir / f"activities-{i:05d}.arrow", tbl))
+
+            # Normalize splits; their metric columns vary, so each batch keeps its own schema for now.
+            # SPLIT_SEQ tags each split with its activity's input position so splits can follow the final order.
+            tbl = splits_table(batch)
+            if tbl.num_rows:
+                seq = [n for n, a in enumerate(batch, n_batched) for _ in a.get("splits", []) or []]
+                tbl = tbl.append_column(SPLIT_SEQ, pa.array(seq, pa.int64()))
+                split_parts.append(spill(tmp_dir / f"splits-{i:05d}.arrow", tbl))
+                split_schemas.append(tbl.schema)
+            n_batched += len(batch)
+
+        if not seen:
+            typer.secho("No activities found in input.", fg=typer.colors.RED, err=True)
+            raise typer.Exit(1)
+        if not act_parts:
+            typer.secho("No running/treadmill_running activities found.", fg=typer.colors.YELLOW)
+            raise typer.Exit(1)
+
+        # Global order by start time, then id (missing values last). The spills stay memory-mapped;
+        # only the sort keys and one gathered row group at a time are held. The sort is stable,
+        # so ties keep input order.
+        acts = pa.concat_tables([read_spill(p) for p in act_parts])
+        act_order = pc.sort_indices(
+            acts.select(["start_time_gmt_ms", "activity_id"]),
+            sort_keys=[("start_time_gmt_ms", "ascending"), ("activity_id", "ascending")],
+            null_placement="at_end",
+        )
+        n_act = write_row_groups(tmp_dir / act_path.name, ACTIVITY_SCHEMA, sorted_row_groups(acts, act_order))
+        n_split = 0
+        if split_parts:
+            # union of every batch's columns; int/float or all-null columns widen instead of clashing.
+            # Each batch is conformed into a second spill so they concatenate zero-copy.
+            schema = pa.unify_schemas(split_schemas, promote_options="permissive")
+            conformed = [spill(p.with_suffix(".conformed.arrow"), conform(read_spill(p), schema)) for p in split_parts]
+            splits = pa.concat_tables([read_spill(p) for p in conformed])
+            # splits follow their activity's output rank; messageIndex order within it is kept
+            rank = pc.sort_indices(act_order)
+            split_order = pc.sort_indices(pc.take(rank, splits[SPLIT_SEQ]))
+            tables = (t.drop_columns([SPLIT_SEQ]) for t in sorted_row_groups(splits, split_order))
+            schema = schema.remove(schema.get_field_index(SPLIT_SEQ))
+            n_split = write_row_groups(tmp_dir / split_path.name, schema, tables)
+            os.replace(tmp_dir / split_path.name, split_path)
+        os.replace(tmp_dir / act_path.name, act_path)
+
+    typer.secho(f"Wrote {n_act:,} rows -> {act_path}", fg=typer.colors.GREEN)
+    if n_split:
+        typer.secho(f"Wrote {n_split:,} rows -> {split_path}", fg=typer.colors.GREEN)
     else:
         typer.secho("No splits found in input (ok if export omitted them).", fg=typer.colors.YELLOW)
 
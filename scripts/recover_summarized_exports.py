@@ -11,17 +11,43 @@ Usage:
 """
 
 from __future__ import annotations
-import json, gzip, sys, argparse
+import gzip, mmap, os, re, shutil, sys, tempfile, argparse
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator
 
-def read_text_auto(p: Path) -> str:
-    raw = p.read_bytes()
-    if raw[:2] == b"\x1f\x8b":
-        raw = gzip.decompress(raw)
-    return raw.decode("utf-8", errors="ignore").lstrip("\ufeff")
+import orjson
 
-def find_all(hay: str, needle: str) -> list[int]:
+FLUSH_EVERY = 10_000  # recovered activities buffered per write
+BOM = b"\xef\xbb\xbf"
+
+# control chars below space (keep newline/tab) -> deleted by str.translate
+_CTRL_TBL = dict.fromkeys(i for i in range(32) if chr(i) not in "\n\t")
+# stray '%' right before ',' / '}' or right after ',' / '{'
+_STRAY = re.compile(r"%(?=[,}])|(?<=[,{])%")
+# '{' (group 1), '}' (group 2), or a whole string literal (escape aware; may run unterminated to the end)
+_TOKEN = re.compile(rb'(\{)|(\})|"[^"\\]*(?:\\.[^"\\]*)*"?', re.S)
+
+@contextmanager
+def map_input(p: Path) -> Iterator[bytes | mmap.mmap]:
+    """Map the export read-only (gzip is inflated to a temp file first); the OS pages in what the scan touches."""
+    with p.open("rb") as f:
+        gz = f.read(2) == b"\x1f\x8b"
+    with ExitStack() as stack:
+        if gz:
+            f = stack.enter_context(tempfile.TemporaryFile())
+            with gzip.open(p, "rb") as src:
+                shutil.copyfileobj(src, f)
+            f.flush()
+        else:
+            f = stack.enter_context(p.open("rb"))
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""  # mmap refuses empty files
+        else:
+            # stays undecoded: only the recovered candidates are ever decoded
+            yield stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+def find_all(hay: bytes | mmap.mmap, needle: bytes) -> list[int]:
     i = 0; out=[]
     while True:
         j = hay.find(needle, i)
@@ -29,64 +55,63 @@ def find_all(hay: str, needle: str) -> list[int]:
         out.append(j); i = j + 1
     return out
 
-def scan_objects(s: str, start: int, end: int | None = None) -> Iterable[str]:
-    """Yield JSON object strings by brace balancing between [start, end). String/escape aware."""
+def scan_objects(s: bytes | mmap.mmap, start: int, end: int | None = None) -> Iterable[bytes]:
+    """Yield JSON object bytes by brace balancing between [start, end). String/escape aware."""
     if end is None: end = len(s)
-    i = start
-    in_str = False; esc = False; depth = 0; obj_start = -1
-    while i < end:
-        ch = s[i]
-        if in_str:
-            if esc: esc = False
-            elif ch == "\\": esc = True
-            elif ch == '"': in_str = False
-            i += 1; continue
-        if ch == '"':
-            in_str = True
-        elif ch == '{':
+    depth = 0; obj_start = -1
+    # the regex engine skips whole string literals, so only braces reach Python
+    for m in _TOKEN.finditer(s, start, end):
+        i = m.start()
+        if m.lastindex == 1:
             if depth == 0: obj_start = i
             depth += 1
-        elif ch == '}':
+        elif m.lastindex == 2:
             depth -= 1
             if depth == 0 and obj_start >= 0:
                 yield s[obj_start:i+1]
                 obj_start = -1
-        i += 1
 
-def looks_like_activity(txt: str) -> bool:
-    # Quick heuristic so we don’t keep wrapper objects
-    return ("\"activityType\"" in txt or "\"activityId\"" in txt) and "\"splitSummaries\"" in txt
+def looks_like_activity(b: bytes) -> bool:
+    # Quick heuristic so we don’t keep wrapper objects.
+    # "splitSummaries" goes first: non-activity objects then fail after one scan instead of two.
+    return b'"splitSummaries"' in b and (b'"activityType"' in b or b'"activityId"' in b)
 
 def light_cleanup(txt: str) -> str:
     # Remove obvious stray control chars (keep newline/tab), fix CELCIUS spelling
-    cleaned = []
-    for c in txt:
-        if c >= " " or c in "\n\t":
-            cleaned.append(c)
-    txt = "".join(cleaned)
+    txt = txt.translate(_CTRL_TBL)
     txt = txt.replace('"CELCIUS"', '"CELSIUS"')
     # strip stray '%' around commas/braces (best-effort)
-    txt = txt.replace(",%", ",").replace("%,", ",").replace("%}", "}").replace("{%", "{")
-    return txt
+    return _STRAY.sub("", txt)
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("input", type=Path)
-    ap.add_argument("--out", type=Path, required=True)
-    args = ap.parse_args()
-
-    s = read_text_auto(args.input)
-    if not s:
-        print("Empty input.", file=sys.stderr); sys.exit(1)
-    if s.lstrip().startswith("<!DOCTYPE html"):
-        print("Looks like an HTML error page; re-download from Garmin.", file=sys.stderr); sys.exit(2)
+def parse_candidate(obj: bytes) -> dict | None:
+    try:
+        return orjson.loads(obj)
+    except Exception:
+        pass
+    # invalid UTF-8 or junk: decode leniently (drops bad bytes), then retry with cleanup
+    txt = obj.decode("utf-8", errors="ignore")
+    try:
+        return orjson.loads(txt)
+    except Exception:
+        try:
+            return orjson.loads(light_cleanup(txt))
+        except Exception:
+            return None
 
+def recover(s: bytes | mmap.mmap, out_path: Path) -> tuple[int, int, int]:
     total_candidates = 0; written = 0; skipped = 0
-    with args.out.open("w", encoding="utf-8") as out:
+    buf: list[bytes] = []
+    with out_path.open("wb") as out:
+        def emit(o) -> None:
+            # serialize straight to bytes; one write per FLUSH_EVERY records
+            buf.append(orjson.dumps(o, option=orjson.OPT_APPEND_NEWLINE))
+            if len(buf) >= FLUSH_EVERY:
+                out.write(b"".join(buf)); buf.clear()
+
         # 1) Preferred: carve inside each "summarizedActivitiesExport":[ ... (even if ']' missing)
-        hits = find_all(s, '"summarizedActivitiesExport"')
+        hits = find_all(s, b'"summarizedActivitiesExport"')
         for h in hits:
-            arr_l = s.find("[", h)
+            arr_l = s.find(b"[", h)
             if arr_l < 0: continue
             # scan from arr_l+1 to EOF for objects; stop when we likely leave the array (heuristic):
             # If we hit ']"' or '}]' followed by comma/new wrapper key, we probably passed the array.
@@ -95,15 +120,11 @@ def main():
                 total_candidates += 1
                 if not looks_like_activity(obj):
                     continue
-                try:
-                    o = json.loads(obj)
-                except Exception:
-                    try:
-                        o = json.loads(light_cleanup(obj))
-                    except Exception:
-                        skipped += 1
-                        continue
-                out.write(json.dumps(o, ensure_ascii=False) + "\n")
+                o = parse_candidate(obj)
+                if o is None:
+                    skipped += 1
+                    continue
+                emit(o)
                 written += 1
 
         # 2) Fallback: if nothing written, scan the whole file for activity-shaped objects
@@ -112,17 +133,31 @@ def main():
                 total_candidates += 1
                 if not looks_like_activity(obj):
                     continue
-                try:
-                    o = json.loads(obj)
-                except Exception:
-                    try:
-                        o = json.loads(light_cleanup(obj))
-                    except Exception:
-                        skipped += 1
-                        continue
-                out.write(json.dumps(o, ensure_ascii=False) + "\n")
+                o = parse_candidate(obj)
+                if o is None:
+                    skipped += 1
+                    continue
+                emit(o)
                 written += 1
 
+        out.write(b"".join(buf))
+
+    return total_candidates, written, skipped
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("input", type=Path)
+    ap.add_argument("--out", type=Path, required=True)
+    args = ap.parse_args()
+
+    with map_input(args.input) as s:
+        head = s[:4096].removeprefix(BOM)
+        if not head:
+            print("Empty input.", file=sys.stderr); sys.exit(1)
+        if head.lstrip().startswith(b"<!DOCTYPE html"):
+            print("Looks like an HTML error page; re-download from Garmin.", file=sys.stderr); sys.exit(2)
+        total_candidates, written, skipped = recover(s, args.out)
+
     print(f"Candidates seen: {total_candidates}; activities written: {written}; skipped: {skipped} -> {args.out}")
     if written == 0:
         print("No activity objects recovered. Double-check the file path and confirm it contains 'splitSummaries' blocks.", file=sys.stderr)